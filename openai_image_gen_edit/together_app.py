@@ -1,13 +1,17 @@
-import base64
+import asyncio
+import atexit
 import os
-import uuid
+import queue
 import logging
+import logging.handlers
+import secrets
 import sys
 from typing import Annotated
 
+import pybase64
 from mcp.server.fastmcp import FastMCP
 from mcp.types import ImageContent
-from together import Together
+from together import AsyncTogether
 from pydantic import Field
 
 # Configure file-based logging for MCP stdio server
@@ -47,8 +51,14 @@ def setup_logging():
             )
             file_handler.setFormatter(formatter)
             
-            logger.addHandler(file_handler)
-            logger.info(f"=== MCP Server Started (PID: {pid}, Log: {log_file}) ===")
+            # Write records from a background thread so tool calls never block on disk I/O
+            log_queue: queue.Queue[logging.LogRecord] = queue.Queue(-1)
+            listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+            listener.start()
+            atexit.register(listener.stop)
+            
+            logger.addHandler(logging.handlers.QueueHandler(log_queue))
+            logger.info("=== MCP Server Started (PID: %s, Log: %s) ===", pid, log_file)
             return logger
         except (PermissionError, OSError):
             continue
@@ -60,91 +70,155 @@ def setup_logging():
 logger = setup_logging()
 
 mcp = FastMCP("together-image-generation")
-client = Together()
+aclient = AsyncTogether()
 IMAGE2IMAGE_MODEL = os.environ["TOGETHER_IMAGE2IMAGE_MODEL_ID"]
 IMAGE2TEXT_MODEL = os.environ["TOGETHER_IMAGE2TEXT_MODEL_ID"]
 TEXT2IMAGE_MODEL = os.environ["TOGETHER_TEXT2IMAGE_MODEL_ID"]
+MAX_CONCURRENT_GENERATIONS = 8
+# Caps in-flight text-to-image requests across all concurrent tool calls
+generation_semaphore = asyncio.Semaphore(MAX_CONCURRENT_GENERATIONS)
+
+# First 4 bytes -> image type; 'RIFF' is only WebP when 'WEBP' follows at offset 8.
+# JPEG matches 0xFF 0xD8 0xFF plus a marker byte (0xC0-0xFF). This is narrower than a bare
+# 0xFF 0xD8 0xFF prefix: a fourth byte below 0xC0, or a header under 4 bytes, falls back to png.
+IMAGE_MAGIC = {
+    b"\x89PNG": "png",
+    b"RIFF": "riff",
+    **{b"\xff\xd8\xff" + bytes((marker,)): "jpeg" for marker in range(0xC0, 0x100)},
+}
+
+def detect_image_type_bytes(header: bytes) -> str:
+    """
+    Detect the image type (e.g., 'png', 'jpeg', 'webp') by inspecting raw magic bytes.
+    """
+    kind = IMAGE_MAGIC.get(bytes(header[:4]), "png")  # default to png
+    if kind == "riff":
+        return "webp" if header[8:12] == b"WEBP" else "png"
+    return kind
 
 def detect_image_type(b64string: str) -> str:
     """
-    Detect the image type (e.g., 'png', 'jpeg', 'webp') by inspecting the decoded magic bytes.
+    Detect the image type (e.g., 'png', 'jpeg', 'webp') by matching the base64 encoding of the magic bytes.
     """
-    # Decode enough bytes to check headers. Using 32 base64 chars -> 24 bytes.
-    header_bytes = base64.b64decode(b64string[:32])
-    
-    # PNG: 8-byte signature
-    if header_bytes.startswith(b"\x89PNG\r\n\x1a\n"):
+    # PNG: base64 of the 8-byte signature
+    if b64string.startswith("iVBORw0KGgo"):
         return "png"
-    # JPEG: starts with 0xFF 0xD8 0xFF
-    if header_bytes.startswith(b"\xff\xd8\xff"):
+    # JPEG: base64 of 0xFF 0xD8 0xFF
+    if b64string.startswith("/9j/"):
         return "jpeg"
-    # WebP: starts with 'RIFF' and contains 'WEBP' at offset 8
-    if header_bytes.startswith(b"RIFF") and header_bytes[8:12] == b"WEBP":
+    # WebP: 'RIFF', then 'WEBP' at byte offset 8 (its last 5 chars land at base64 offset 11)
+    if b64string.startswith("UklGR") and b64string[11:16] == "XRUJQ":
         return "webp"
     return "png"  # default to png
 
-@mcp.tool(description="Generate an image from a text description using Together AI.")
-def generate_image(
-    prompt: Annotated[str, Field(description="A text description of the desired image.")],
-) -> ImageContent:
-    logger.info(f"generate_image called - prompt: {prompt[:100]}... - model: {TEXT2IMAGE_MODEL}")
-    
-    try:
-        response = client.images.generate(
+def read_image_base64(path: str) -> tuple[str, str]:
+    """
+    Read an image file and return its base64 encoding and detected type (e.g., 'png').
+    """
+    # Not mmap'd: a file truncated by another process would SIGBUS the server mid-encode.
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data:
+        raise ValueError(f"Image file is empty: {path}")
+    return pybase64.b64encode_as_string(data), detect_image_type_bytes(data[:16])
+
+async def encode_image_file(path: str) -> tuple[str, str]:
+    """
+    Read and base64-encode an image file in the default executor so the event loop is not blocked.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, read_image_base64, path)
+
+async def text_to_image(prompt: str, case_id: str) -> ImageContent:
+    """
+    Generate a single image for a prompt with the text-to-image model.
+    """
+    async with generation_semaphore:
+        response = await aclient.images.generate(
             prompt=prompt,
             model=TEXT2IMAGE_MODEL,
             width=1024,
             height=1792,
             steps=4,
             n=1,
+            response_format="b64_json",
         )
-        logger.info(f"API response received - images: {len(response.data)}")
-        
-        if not response.data:
-            logger.warning("No images generated in response")
-            raise ValueError("No images generated")
+    data = response.data
+    logger.info("API response received - images: %d", len(data))
+    
+    if not data:
+        logger.warning("No images generated in response")
+        raise ValueError("No images generated")
 
-        case_id = uuid.uuid4().hex
-        image = response.data[0]
-        
-        # Download the image from URL and convert to base64
-        if image.url:
-            import requests
-            img_response = requests.get(image.url)
-            image_base64 = base64.b64encode(img_response.content).decode('utf-8')
-        elif image.b64_json:
-            image_base64 = image.b64_json
-        else:
-            raise ValueError("No image data in response")
-        
-        output_format = detect_image_type(image_base64)
-        result = ImageContent(
-            type="image",
-            data=image_base64,
-            mimeType=f"image/{output_format}",
-            annotations={"case_id": case_id, "prompt": prompt},
-        )
+    image = data[0]
+    
+    image_base64 = image.b64_json
+    if not image_base64:
+        raise ValueError("No image data in response")
+    
+    output_format = detect_image_type(image_base64)
+    return ImageContent(
+        type="image",
+        data=image_base64,
+        mimeType=f"image/{output_format}",
+        annotations={"case_id": case_id, "prompt": prompt},
+    )
+
+@mcp.tool(description="Generate an image from a text description using Together AI.")
+async def generate_image(
+    prompt: Annotated[str, Field(description="A text description of the desired image.")],
+) -> ImageContent:
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("generate_image called - prompt: %s... - model: %s", prompt[:100], TEXT2IMAGE_MODEL)
+    
+    try:
+        case_id = secrets.token_hex(16)
+        result = await text_to_image(prompt, case_id)
         
-        logger.info(f"generate_image completed - case_id: {case_id}")
+        logger.info("generate_image completed - case_id: %s", case_id)
         return result
     except Exception as e:
-        logger.error(f"generate_image failed - error: {str(e)}", exc_info=True)
+        logger.error("generate_image failed - error: %s", e)  # noqa: TRY400
+        logger.debug("generate_image traceback", exc_info=True)
+        raise
+
+@mcp.tool(description="Generate several images concurrently, one per text description, using Together AI.")
+async def generate_images(
+    prompts: Annotated[list[str], Field(description="A list of text descriptions, one per desired image.")],
+) -> list[ImageContent]:
+    logger.info("generate_images called - prompts: %d - model: %s", len(prompts), TEXT2IMAGE_MODEL)
+    
+    case_ids = [secrets.token_hex(16) for _ in prompts]
+    tasks = [asyncio.ensure_future(text_to_image(prompt, case_id)) for prompt, case_id in zip(prompts, case_ids)]
+    try:
+        results = await asyncio.gather(*tasks)
+        
+        logger.info("generate_images completed - case_ids: %s", ", ".join(case_ids))
+        return results
+    except Exception as e:
+        # Stop the remaining generations and reap them so none keeps running or leaves an unretrieved error
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logger.error("generate_images failed - error: %s", e)  # noqa: TRY400
+        logger.debug("generate_images traceback", exc_info=True)
         raise
 
 @mcp.tool(description="Edit or transform an image based on a text description using a reference image.")
-def edit_image(
+async def edit_image(
     image_path: Annotated[str, Field(description="The path to the image file to edit (use absolute path).")],
     prompt: Annotated[str, Field(description="A text description of how to edit/transform the image.")],
 ) -> ImageContent:
-    logger.info(f"edit_image called - image_path: {image_path}, prompt: {prompt[:100]}... - model: {IMAGE2IMAGE_MODEL}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "edit_image called - image_path: %s, prompt: %s... - model: %s", image_path, prompt[:100], IMAGE2IMAGE_MODEL
+        )
     
     try:
         # Read and encode the image
-        with open(image_path, "rb") as f:
-            image_data = f.read()
-        image_base64 = base64.b64encode(image_data).decode('utf-8')
+        image_base64, _ = await encode_image_file(image_path)
         
-        response = client.images.generate(
+        response = await aclient.images.generate(
             prompt=prompt,
             model=IMAGE2IMAGE_MODEL,
             condition_image=image_base64,
@@ -152,24 +226,20 @@ def edit_image(
             height=1024,
             steps=4,
             n=1,
+            response_format="b64_json",
         )
-        logger.info(f"API response received - images: {len(response.data)}")
+        data = response.data
+        logger.info("API response received - images: %d", len(data))
         
-        if not response.data:
+        if not data:
             logger.warning("No images generated in response")
             raise ValueError("No images generated")
 
-        case_id = uuid.uuid4().hex
-        image = response.data[0]
+        case_id = secrets.token_hex(16)
+        image = data[0]
         
-        # Download the image from URL and convert to base64
-        if image.url:
-            import requests
-            img_response = requests.get(image.url)
-            result_base64 = base64.b64encode(img_response.content).decode('utf-8')
-        elif image.b64_json:
-            result_base64 = image.b64_json
-        else:
+        result_base64 = image.b64_json
+        if not result_base64:
             raise ValueError("No image data in response")
         
         output_format = detect_image_type(result_base64)
@@ -180,30 +250,28 @@ def edit_image(
             annotations={"case_id": case_id, "prompt": prompt, "source_image": image_path},
         )
         
-        logger.info(f"edit_image completed - case_id: {case_id}")
+        logger.info("edit_image completed - case_id: %s", case_id)
         return result
     except Exception as e:
-        logger.error(f"edit_image failed - error: {str(e)}", exc_info=True)
+        logger.error("edit_image failed - error: %s", e)  # noqa: TRY400
+        logger.debug("edit_image traceback", exc_info=True)
         raise
 
 @mcp.tool(description="Describe what's in an image using vision AI.")
-def describe_image(
+async def describe_image(
     image_path: Annotated[str, Field(description="The path to the image file to describe (use absolute path).")],
 ) -> str:
-    logger.info(f"describe_image called - image_path: {image_path} - model: {IMAGE2TEXT_MODEL}")
+    logger.info("describe_image called - image_path: %s - model: %s", image_path, IMAGE2TEXT_MODEL)
     
     try:
-        # Read and encode the image
-        with open(image_path, "rb") as f:
-            image_data = f.read()
-        image_base64 = base64.b64encode(image_data).decode('utf-8')
+        # Read the image, sniff the format from its header, then encode once for the data URL
+        image_base64, image_type = await encode_image_file(image_path)
         
         # Create a data URL for the image
-        image_type = detect_image_type(image_base64)
-        image_url = f"data:image/{image_type};base64,{image_base64}"
+        image_url = "".join(("data:image/", image_type, ";base64,", image_base64))
         
         # Use Together AI's vision model to describe the image
-        response = client.chat.completions.create(
+        response = await aclient.chat.completions.create(
             model=IMAGE2TEXT_MODEL,
             messages=[
                 {
@@ -217,9 +285,10 @@ def describe_image(
         )
         
         description = response.choices[0].message.content
-        logger.info(f"describe_image completed - description length: {len(description)}")
+        logger.info("describe_image completed - description length: %d", len(description))
         return description
     except Exception as e:
-        logger.error(f"describe_image failed - error: {str(e)}", exc_info=True)
+        logger.error("describe_image failed - error: %s", e)  # noqa: TRY400
+        logger.debug("describe_image traceback", exc_info=True)
         raise
 
@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# together_app reads its configuration from the environment at import time
+os.environ.setdefault("AGENT_SHARED_DIR", tempfile.gettempdir())
+os.environ.setdefault("TOGETHER_API_KEY", "test-key")
+os.environ.setdefault("TOGETHER_IMAGE2IMAGE_MODEL_ID", "test/image2image")
+os.environ.setdefault("TOGETHER_IMAGE2TEXT_MODEL_ID", "test/image2text")
+os.environ.setdefault("TOGETHER_TEXT2IMAGE_MODEL_ID", "test/text2image")
@@ -0,0 +1,87 @@
+import asyncio
+import base64
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from openai_image_gen_edit import together_app
+from openai_image_gen_edit.together_app import detect_image_type, detect_image_type_bytes, read_image_base64
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR"
+JPEG_HEADER = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00"
+# The RIFF size field (bytes 4-8) is arbitrary, so the WebP check must not depend on it
+WEBP_HEADERS = [
+    b"RIFF" + size + b"WEBPVP8 " for size in (b"\x00\x00\x00\x00", b"\x24\x8f\x01\x00", b"\xff\xff\xff\xff")
+]
+WAVE_HEADER = b"RIFF\x24\x8f\x01\x00WAVEfmt "
+
+
+@pytest.mark.parametrize(
+    ("header", "expected"),
+    [
+        (PNG_HEADER, "png"),
+        (JPEG_HEADER, "jpeg"),
+        *[(header, "webp") for header in WEBP_HEADERS],
+        (WAVE_HEADER, "png"),
+        (b"GIF89a\x01\x00\x01\x00", "png"),
+        (b"", "png"),
+    ],
+)
+def test_detect_image_type(header: bytes, expected: str) -> None:
+    assert detect_image_type_bytes(header) == expected
+    assert detect_image_type(base64.b64encode(header + b"\x00" * 16).decode()) == expected
+
+
+@pytest.mark.parametrize("header", [b"\xff\xd8\xff\x00", b"\xff\xd8\xff"])
+def test_detect_image_type_bytes_requires_jpeg_marker(header: bytes) -> None:
+    # Only 0xFF 0xD8 0xFF followed by a marker byte (0xC0-0xFF) is treated as JPEG
+    assert detect_image_type_bytes(header) == "png"
+
+
+def test_read_image_base64(tmp_path: Path) -> None:
+    image_path = tmp_path / "image.jpg"
+    image_path.write_bytes(JPEG_HEADER * 100)
+    assert read_image_base64(str(image_path)) == (base64.b64encode(JPEG_HEADER * 100).decode(), "jpeg")
+
+
+def test_read_image_base64_rejects_empty_file(tmp_path: Path) -> None:
+    image_path = tmp_path / "empty.png"
+    image_path.touch()
+    with pytest.raises(ValueError, match="empty"):
+        read_image_base64(str(image_path))
+
+
+class GenerationError(Exception):
+    pass
+
+
+async def test_generate_images_cancels_pending_generations_on_failure(monkeypatch: pytest.MonkeyPatch) -> None:
+    cancelled = asyncio.Event()
+
+    async def fake_generate(prompt: str, **kwargs: object) -> SimpleNamespace:
+        if prompt == "fail":
+            raise GenerationError
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return SimpleNamespace(data=[])
+
+    monkeypatch.setattr(together_app.aclient.images, "generate", fake_generate)
+    with pytest.raises(GenerationError):
+        await together_app.generate_images(["slow", "fail"])
+    assert cancelled.is_set()
+
+
+async def test_generate_images_returns_one_image_per_prompt(monkeypatch: pytest.MonkeyPatch) -> None:
+    png_base64 = base64.b64encode(PNG_HEADER).decode()
+
+    async def fake_generate(prompt: str, **kwargs: object) -> SimpleNamespace:
+        return SimpleNamespace(data=[SimpleNamespace(b64_json=png_base64)])
+
+    monkeypatch.setattr(together_app.aclient.images, "generate", fake_generate)
+    results = await together_app.generate_images(["a", "b", "c"])
+    assert [result.data for result in results] == [png_base64] * 3
+    assert [result.mimeType for result in results] == ["image/png"] * 3